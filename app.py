@@ -1,116 +1,313 @@
-from flask import Flask, render_template, request, send_file
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from datetime import datetime
-import pandas as pd
+from flask import Flask, render_template, request, send_file, abort, jsonify, g, Response
+import click
+from psycopg2.extras import RealDictCursor, execute_values
+from datetime import datetime, timedelta
+import hmac
 import os
-from math import radians, cos, sin, asin, sqrt
-from openpyxl.styles import Font, PatternFill
-from openpyxl.drawing.image import Image as OpenpyxlImage
+import time
+from math import isfinite
+from db import get_db_connection, init_db
+from export import export_filename, get_week_export
+from geofence import geofence
+from ingest import write_check_in, write_check_ins
+from stats import fetch_weekly_stats, fold_weekly_deltas, rebuild_weekly_stats
+from metrics import (GEOFENCE_REJECTED_DISTANCE, GEOFENCE_REJECTIONS, REQUEST_SECONDS,
+                     render_metrics)
 
 app = Flask(__name__)
 
 # CONFIGURATION
-CAMPUS_LAT = -26.099059
-CAMPUS_LON = 28.0538272
-MAX_DISTANCE_KM = 0.2 
 START_DATE = datetime(2026, 2, 13)
+COURSES = ('WPE', 'MCC')
+ADMIN_PAGE_SIZE = 50
+API_MAX_BATCH = 1000
+# How far ahead of the server clock a kiosk timestamp may be.
+API_MAX_CLOCK_SKEW = timedelta(minutes=int(os.environ.get('API_MAX_CLOCK_SKEW_MINUTES', 10)))
+# How long a kiosk may hold entries offline before they can no longer be synced.
+API_MAX_BACKFILL = timedelta(days=int(os.environ.get('API_MAX_BACKFILL_DAYS', 7)))
+# Shared secret kiosks send as "Authorization: Bearer <token>"; the bulk
+# API is disabled while it is unset.
+KIOSK_API_TOKEN = os.environ.get('KIOSK_API_TOKEN')
+REQUIRED_FIELDS = ('first_name', 'last_name', 'id_passport', 'email', 'phone',
+                   'ethnicity', 'gender', 'course')
+TEXT_FIELDS = REQUIRED_FIELDS + ('middle_name',)
+# Requests slower than this many milliseconds are logged; unset to disable.
+SLOW_REQUEST_MS = float(os.environ['SLOW_REQUEST_MS']) if os.environ.get('SLOW_REQUEST_MS') else None
 
-def get_db_url():
-    """Corrects the postgres prefix for SQLAlchemy/Psycopg2 compatibility."""
-    url = os.environ.get('DATABASE_URL')
-    if url and url.startswith("postgres://"):
-        return url.replace("postgres://", "postgresql://", 1)
-    return url
-
-def get_db_connection():
-    return psycopg2.connect(get_db_url())
-
-def init_db():
-    """Aggressively ensures the check_ins table exists."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS check_ins (
-            id SERIAL PRIMARY KEY,
-            first_name TEXT NOT NULL,
-            middle_name TEXT,
-            last_name TEXT NOT NULL,
-            id_passport TEXT NOT NULL,
-            email TEXT NOT NULL,
-            phone TEXT NOT NULL,
-            ethnicity TEXT,
-            gender TEXT,
-            course TEXT,
-            week_number INTEGER,
-            check_in_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    cur.close()
-    conn.close()
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+def _record_request(status):
+    start = g.pop('request_start', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_SECONDS.labels(method=request.method, route=route, status=status).observe(elapsed)
+    if SLOW_REQUEST_MS is not None and elapsed * 1000 >= SLOW_REQUEST_MS:
+        app.logger.warning("Slow request: %s %s -> %s in %.0fms", request.method, request.path, status, elapsed * 1000)
+
+@app.after_request
+def record_request(response):
+    _record_request(response.status_code)
+    return response
+
+@app.teardown_request
+def record_failed_request(exc):
+    # Only reached with a start time still set if after_request never ran.
+    if exc is not None:
+        _record_request(500)
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+class CheckInRejected(Exception):
+    """A check-in that failed validation; title/message are shown to the student."""
+
+    def __init__(self, title, message):
+        super().__init__(message)
+        self.title = title
+        self.message = message
+
+def week_number_for(when):
+    return max(1, ((when - START_DATE).days // 7) + 1)
+
+def build_check_in(fields, when):
+    """Validates one check-in and returns its row in CHECK_IN_COLUMNS order."""
+    user_lat = fields.get('latitude')
+    user_lon = fields.get('longitude')
+    if user_lat in (None, '') or user_lon in (None, ''):
+        raise CheckInRejected("Location Required", "Please enable GPS to verify your attendance.")
+    for value in (user_lat, user_lon):
+        # JSON callers can send anything; bool is an int subclass, so exclude it.
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise CheckInRejected("Location Required", "Latitude and longitude must be numbers.")
+    try:
+        user_lat, user_lon = float(user_lat), float(user_lon)
+    except ValueError:
+        raise CheckInRejected("Location Required", "Please enable GPS to verify your attendance.")
+    if not (isfinite(user_lat) and isfinite(user_lon)):
+        raise CheckInRejected("Location Required", "Please enable GPS to verify your attendance.")
+
+    wrong_type = [name for name in TEXT_FIELDS if not isinstance(fields.get(name), (str, type(None)))]
+    if wrong_type:
+        raise CheckInRejected("Invalid Details", f"These fields must be text: {', '.join(wrong_type)}.")
+
+    missing = [name for name in REQUIRED_FIELDS if not fields.get(name)]
+    if missing:
+        raise CheckInRejected("Details Required", f"Please provide: {', '.join(missing)}.")
+
+    course = fields.get('course')
+    if course not in COURSES:
+        raise CheckInRejected("Invalid Details", f"Course must be one of: {', '.join(COURSES)}.")
+    site = geofence.match(user_lat, user_lon, course)
+    if site is None:
+        nearest, dist = geofence.nearest(user_lat, user_lon, course)
+        GEOFENCE_REJECTIONS.labels(site=nearest.name).inc()
+        GEOFENCE_REJECTED_DISTANCE.labels(site=nearest.name).observe(dist * 1000)
+        raise CheckInRejected("Check-in Denied", f"You must be at {nearest.name}. Distance: {round(dist*1000)}m.")
+
+    return (
+        fields.get('first_name'), fields.get('middle_name'),
+        fields.get('last_name'), fields.get('id_passport'),
+        fields.get('email'), fields.get('phone'),
+        fields.get('ethnicity'), fields.get('gender'),
+        course, week_number_for(when), user_lat, user_lon, site.name, when
+    )
+
 @app.route('/submit', methods=['POST'])
 def submit():
-    # Force initialization right before the insert to prevent "Table Not Found"
     try:
-        init_db()
-    except Exception as e:
-        print(f"Table Init Error: {e}")
-
-    user_lat = request.form.get('latitude')
-    user_lon = request.form.get('longitude')
-    
-    if not user_lat or not user_lon:
-        return "<h1>Location Required</h1><p>Please enable GPS to verify your attendance.</p>"
-
-    dist = calculate_distance(float(user_lat), float(user_lon))
-    if dist > MAX_DISTANCE_KM:
-        return f"<h1>Check-in Denied</h1><p>You must be at 85 Grayston Drive. Distance: {round(dist*1000)}m.</p>"
-
-    today = datetime.now()
-    week_num = max(1, ((today - START_DATE).days // 7) + 1)
-
-    data = (
-        request.form.get('first_name'), request.form.get('middle_name'),
-        request.form.get('last_name'), request.form.get('id_passport'),
-        request.form.get('email'), request.form.get('phone'),
-        request.form.get('ethnicity'), request.form.get('gender'),
-        request.form.get('course'), week_num
-    )
+        data = build_check_in(request.form, datetime.now())
+    except CheckInRejected as e:
+        return f"<h1>{e.title}</h1><p>{e.message}</p>"
 
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('''INSERT INTO check_ins 
-        (first_name, middle_name, last_name, id_passport, email, phone, ethnicity, gender, course, week_number)
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)''', data)
-    conn.commit()
-    cur.close()
-    conn.close()
+    if not write_check_in(data):
+        return f"<h1>Already Checked In</h1><p>Your attendance for week {data[9]} has already been recorded.</p>"
     return render_template('success.html', name=data[0])
 
+@app.route('/api/checkins', methods=['POST'])
+def api_checkins():
+    """Bulk check-in for kiosks syncing entries queued while offline.
+
+    Accepts a JSON list (or {"check_ins": [...]}) of objects with the form
+    fields plus a client "timestamp"; reports a status for every item.
+    Client timestamps are only trusted from kiosks holding KIOSK_API_TOKEN.
+    """
+    if not KIOSK_API_TOKEN:
+        return jsonify(error="The kiosk API is not enabled on this server."), 403
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.encode(), KIOSK_API_TOKEN.encode()):
+        return jsonify(error="A valid kiosk token is required."), 401
+
+    payload = request.get_json(silent=True)
+    items = payload.get('check_ins') if isinstance(payload, dict) else payload
+    if not isinstance(items, list):
+        return jsonify(error="Expected a JSON list of check-ins."), 400
+    if len(items) > API_MAX_BATCH:
+        return jsonify(error=f"At most {API_MAX_BATCH} check-ins per request."), 413
+
+    now = datetime.now()
+    results, rows, row_index = [], [], []
+    for i, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise CheckInRejected("Invalid Entry", "Each check-in must be a JSON object.")
+            try:
+                when = datetime.fromisoformat(item.get('timestamp'))
+            except (TypeError, ValueError):
+                raise CheckInRejected("Invalid Entry", "A valid ISO 8601 timestamp is required.")
+            if when.tzinfo is not None:
+                when = when.astimezone().replace(tzinfo=None)
+            # A kiosk with a wrong clock must not record future (or pre-term) weeks.
+            if when > now + API_MAX_CLOCK_SKEW:
+                raise CheckInRejected("Invalid Entry", "Timestamp is in the future; check the device clock.")
+            if when < START_DATE:
+                raise CheckInRejected("Invalid Entry", "Timestamp is before the start of term.")
+            if when < now - API_MAX_BACKFILL:
+                raise CheckInRejected("Invalid Entry", "Timestamp is too old to sync; record it manually.")
+            rows.append(build_check_in(item, when))
+            row_index.append(i)
+            results.append(None)
+        except CheckInRejected as e:
+            results.append({'index': i, 'status': 'rejected', 'error': e.message})
+
+    for i, row, written in zip(row_index, rows, write_check_ins(rows)):
+        results[i] = {'index': i, 'status': 'created' if written else 'duplicate', 'week_number': row[9]}
+    return jsonify(results=results)
+
 @app.route('/admin')
 def admin():
-    init_db()
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute('SELECT * FROM check_ins ORDER BY check_in_time DESC')
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    return render_template('admin.html', rows=rows)
-
-# Helper function for distance
-def calculate_distance(lat1, lon1):
-    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, CAMPUS_LON, CAMPUS_LAT])
-    dlon, dlat = lon2 - lon1, lat2 - lat1
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    return 2 * asin(sqrt(a)) * 6371
+    course = request.args.get('course') or None
+    week = request.args.get('week', type=int)
+    search = (request.args.get('q') or '').strip()
+    after = request.args.get('after')
+
+    # Keyset pagination: each page starts strictly after the last
+    # (check_in_time, id) seen, so deep pages cost the same as the first.
+    clauses, params = [], []
+    if course:
+        clauses.append('course = %s')
+        params.append(course)
+    if week:
+        clauses.append('week_number = %s')
+        params.append(week)
+    if search:
+        prefix = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        clauses.append('(id_passport LIKE %s OR lower(first_name) LIKE lower(%s) OR lower(last_name) LIKE lower(%s))')
+        params.extend([prefix, prefix, prefix])
+    if after:
+        try:
+            after_time, after_id = after.rsplit('|', 1)
+            after_key = (datetime.fromisoformat(after_time), int(after_id))
+        except ValueError:
+            abort(400)
+        clauses.append('(check_in_time, id) < (%s, %s)')
+        params.extend(after_key)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+
+    with get_db_connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(f'''SELECT id, first_name, last_name, id_passport, course, week_number,
+                ethnicity, gender, check_in_time
+            FROM check_ins {where}
+            ORDER BY check_in_time DESC, id DESC
+            LIMIT %s''', params + [ADMIN_PAGE_SIZE + 1])
+        rows = cur.fetchall()
+        cur.close()
+
+    next_after = None
+    if len(rows) > ADMIN_PAGE_SIZE:
+        rows = rows[:ADMIN_PAGE_SIZE]
+        last = rows[-1]
+        next_after = f"{last['check_in_time'].isoformat()}|{last['id']}"
+    filters = {k: v for k, v in (('course', course), ('week', week), ('q', search)) if v}
+    return render_template('admin.html', rows=rows, filters=filters, courses=COURSES,
+                           next_after=next_after, paged=bool(after))
+
+@app.route('/admin/stats')
+def admin_stats():
+    course = request.args.get('course') or None
+    with get_db_connection() as conn:
+        weeks = fetch_weekly_stats(conn, course)
+    return render_template('stats.html', weeks=weeks, course=course, courses=COURSES)
+
+@app.route('/admin/stats.json')
+def admin_stats_json():
+    course = request.args.get('course') or None
+    with get_db_connection() as conn:
+        weeks = fetch_weekly_stats(conn, course)
+    return jsonify(weeks)
+
+@app.route('/metrics')
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+@app.route('/download/<course>/<int:week>')
+def download(course, week):
+    if course not in COURSES or week < 1:
+        abort(404)
+    export = get_week_export(course, week)
+    return send_file(export, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                     as_attachment=True, download_name=export_filename(course, week))
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Creates the check-in schema and applies pending migrations."""
+    applied = init_db()
+    click.echo(f"Applied migrations: {applied}" if applied else "Schema is up to date.")
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recomputes attendance_weekly from check_ins and reports drift."""
+    with get_db_connection() as conn:
+        drift = rebuild_weekly_stats(conn)
+    click.echo(f"Rebuilt attendance_weekly; {drift} group(s) had drifted from check_ins.")
+
+@app.cli.command('fold-stats')
+def fold_stats_command():
+    """Folds pending attendance_weekly_delta rows into attendance_weekly."""
+    with get_db_connection() as conn:
+        updated = fold_weekly_deltas(conn)
+    click.echo(f"Folded deltas into {updated} attendance_weekly group(s).")
+
+@app.cli.command('revalidate-sites')
+@click.option('--update', is_flag=True, help="Write the re-matched site back to each row.")
+@click.option('--chunk-size', default=5000, show_default=True)
+def revalidate_sites_command(update, chunk_size):
+    """Re-checks stored check-in coordinates against the current sites."""
+    matched = unmatched = changed = 0
+    with get_db_connection() as conn:
+        rows = conn.cursor(name='revalidate_sites')
+        rows.itersize = chunk_size
+        rows.execute('''SELECT id, latitude, longitude, course, site FROM check_ins
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL ORDER BY id''')
+        writer = conn.cursor()
+        while True:
+            chunk = rows.fetchmany(chunk_size)
+            if not chunk:
+                break
+            ids, lats, lons, courses, sites = zip(*chunk)
+            hits = geofence.match_many(lats, lons, courses)
+            names = [geofence.sites[k].name if k >= 0 else None for k in hits]
+            matched += sum(1 for n in names if n)
+            unmatched += sum(1 for n in names if not n)
+            updates = [(row_id, name) for row_id, name, old in zip(ids, names, sites) if name != old]
+            changed += len(updates)
+            if update and updates:
+                execute_values(writer, '''UPDATE check_ins SET site = v.site
+                    FROM (VALUES %s) AS v (id, site) WHERE check_ins.id = v.id''', updates)
+        rows.close()
+        writer.close()
+        if update:
+            conn.commit()
+    click.echo(f"Matched: {matched}, outside every site: {unmatched}, "
+               f"site {'updated' if update else 'would change'}: {changed}")
 
 if __name__ == '__main__':
+    init_db()
     port = int(os.environ.get("PORT", 5000))
     app.run(host='0.0.0.0', port=port)
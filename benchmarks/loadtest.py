@@ -0,0 +1,252 @@
+"""Synthetic check-in burst benchmark.
+
+Simulates a class arriving at once: N students (some outside every site,
+some double-submitting) post to /submit across WPE and MCC, then admins
+page through /admin and pull the weekly exports. Reports throughput and
+p50/p95/p99 latency per endpoint and writes them to a JSON file.
+
+Runs in-process against the Flask app (needs DATABASE_URL pointing at a
+local PostgreSQL), or over HTTP against a running server, e.g.:
+
+    flask --app app init-db
+    gunicorn -c gunicorn.conf.py -w 4 app:app &
+    python benchmarks/loadtest.py --url http://127.0.0.1:8000 --students 500
+
+Pass --baseline with an earlier results file to print the change.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from geofence import EARTH_RADIUS_KM, geofence  # noqa: E402
+
+COURSES = ('WPE', 'MCC')
+ETHNICITIES = ('Black African', 'Coloured', 'Indian/Asian', 'White')
+GENDERS = ('Male', 'Female', 'Other')
+
+
+def _offset(lat, lon, distance_km, rng):
+    """A point distance_km from (lat, lon) in a random direction."""
+    bearing = rng.uniform(0, 2 * math.pi)
+    dlat = distance_km / EARTH_RADIUS_KM * math.cos(bearing)
+    dlon = distance_km / EARTH_RADIUS_KM * math.sin(bearing) / math.cos(math.radians(lat))
+    return lat + math.degrees(dlat), lon + math.degrees(dlon)
+
+
+def build_burst(students, invalid_ratio, duplicate_ratio, run_id, seed):
+    """Form payloads for one start-of-class burst, shuffled like real arrivals."""
+    rng = random.Random(seed)
+    forms = []
+    for n in range(students):
+        course = rng.choice(COURSES)
+        sites = [s for s in geofence.sites if s.allows(course)] or geofence.sites
+        site = rng.choice(sites)
+        if rng.random() < invalid_ratio:
+            lat, lon = _offset(site.lat, site.lon, site.radius_km + rng.uniform(0.5, 5), rng)
+        else:
+            lat, lon = _offset(site.lat, site.lon, site.radius_km * rng.uniform(0, 0.9), rng)
+        form = {
+            'first_name': f'Bench{n}', 'middle_name': '', 'last_name': 'Student',
+            'id_passport': f'BENCH-{run_id}-{n:06d}', 'email': f'bench{n}@example.com',
+            'phone': f'07{n:08d}', 'ethnicity': rng.choice(ETHNICITIES), 'gender': rng.choice(GENDERS),
+            'course': course, 'latitude': f'{lat:.7f}', 'longitude': f'{lon:.7f}',
+        }
+        forms.append(form)
+        if rng.random() < duplicate_ratio:
+            forms.append(dict(form))
+    rng.shuffle(forms)
+    return forms
+
+
+class InProcessClient:
+    def __init__(self):
+        from app import app
+        self.app = app
+
+    def request(self, method, path, data=None):
+        with self.app.test_client() as client:
+            response = client.open(path, method=method, data=data)
+            response.get_data()
+            return response.status_code
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=60) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def run_phase(client, name, requests, concurrency):
+    """Fires (method, path, data) requests and summarises their latency."""
+    def timed(req):
+        method, path, data = req
+        start = time.perf_counter()
+        try:
+            status = client.request(method, path, data)
+        except Exception:
+            status = None
+        return time.perf_counter() - start, status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, requests))
+    wall = time.perf_counter() - start
+
+    latencies = sorted(elapsed * 1000 for elapsed, _ in results)
+    errors = sum(1 for _, status in results if status is None or status >= 500)
+    summary = {
+        'endpoint': name,
+        'requests': len(results),
+        'errors': errors,
+        'wall_seconds': round(wall, 4),
+        'throughput_rps': round(len(results) / wall, 2) if wall and results else None,
+    }
+    for pct in (50, 95, 99):
+        value = _percentile(latencies, pct)
+        summary[f'p{pct}_ms'] = round(value, 2) if value is not None else None
+    summary['max_ms'] = round(latencies[-1], 2) if latencies else None
+    return summary
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def cleanup(run_id):
+    """Removes this run's rows and brings attendance_weekly back in line."""
+    from db import get_db_connection
+    from stats import rebuild_weekly_stats
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('DELETE FROM check_ins WHERE id_passport LIKE %s', (f'BENCH-{run_id}-%',))
+        deleted = cur.rowcount
+        conn.commit()
+        cur.close()
+        rebuild_weekly_stats(conn)
+    return deleted
+
+
+def print_report(results, baseline=None):
+    before = {r['endpoint']: r for r in (baseline or {}).get('endpoints', [])}
+    print(f"{'endpoint':<12}{'reqs':>7}{'errs':>6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for r in results['endpoints']:
+        cells = ['-' if r[k] is None else r[k] for k in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms')]
+        print(f"{r['endpoint']:<12}{r['requests']:>7}{r['errors']:>6}"
+              + ''.join(f"{cell:>10}" for cell in cells))
+        old = before.get(r['endpoint'])
+        if old and old.get('p95_ms') and old.get('throughput_rps'):
+            print(f"{'':<12}vs baseline: p95 {100 * (r['p95_ms'] / old['p95_ms'] - 1):+.1f}%, "
+                  f"throughput {100 * (r['throughput_rps'] / old['throughput_rps'] - 1):+.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help="Base URL of a running server; omit to run in-process.")
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--invalid-ratio', type=float, default=0.1,
+                        help="Share of students submitting from outside every site.")
+    parser.add_argument('--duplicate-ratio', type=float, default=0.05,
+                        help="Share of students who submit twice.")
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--admin-requests', type=int, default=50)
+    parser.add_argument('--download-requests', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="Results file (default: benchmarks/results/<timestamp>.json).")
+    parser.add_argument('--baseline', help="Earlier results file to compare against.")
+    parser.add_argument('--cleanup', action='store_true',
+                        help="Delete this run's check-ins afterwards (needs DATABASE_URL).")
+    args = parser.parse_args(argv)
+
+    run_id = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+    if not args.url:
+        # In-process requests share this process's pool: size it before the
+        # app is imported (headroom for the batch writer), so the run measures
+        # the app rather than pool waits. If a caller already imported db
+        # the size is fixed, so cap concurrency to fit it instead.
+        if 'db' in sys.modules:
+            pool_max = sys.modules['db'].DB_POOL_MAX
+            if pool_max < args.concurrency + 2:
+                args.concurrency = max(1, pool_max - 2)
+                print(f"Pool already sized at {pool_max}; limiting concurrency to {args.concurrency}.")
+        else:
+            pool_max = max(int(os.environ.get('DB_POOL_MAX', 10)), args.concurrency + 2)
+            os.environ['DB_POOL_MAX'] = str(pool_max)
+    client = HttpClient(args.url) if args.url else InProcessClient()
+    forms = build_burst(args.students, args.invalid_ratio, args.duplicate_ratio, run_id, args.seed)
+
+    from app import week_number_for
+    week = week_number_for(datetime.now())
+    rng = random.Random(args.seed)
+    admin_requests = []
+    for _ in range(args.admin_requests):
+        query = rng.choice(['', '?course=WPE', f'?course=MCC&week={week}', '?q=Bench1'])
+        admin_requests.append(('GET', '/admin' + query, None))
+    download_requests = [('GET', f'/download/{rng.choice(COURSES)}/{week}', None)
+                         for _ in range(args.download_requests)]
+
+    endpoints = [
+        run_phase(client, '/submit', [('POST', '/submit', form) for form in forms], args.concurrency),
+        run_phase(client, '/admin', admin_requests, args.concurrency),
+        run_phase(client, '/download', download_requests, args.concurrency),
+    ]
+    results = {
+        'run_id': run_id,
+        'revision': _git_revision(),
+        'target': args.url or 'in-process',
+        'python': platform.python_version(),
+        'parameters': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+        'endpoints': endpoints,
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results', f'{run_id}.json')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.cleanup:
+        print(f"Removed {cleanup(run_id)} benchmark check-ins.")
+
+
+if __name__ == '__main__':
+    main()
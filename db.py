@@ -0,0 +1,287 @@
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions, pool
+
+from metrics import COMMIT_SECONDS, CONNECTION_ACQUIRE_SECONDS, QUERY_SECONDS
+
+# CONFIGURATION
+# psycopg2 pools only keep DB_POOL_MIN idle connections around; anything
+# above that is closed on return, so size the minimum for normal load.
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 2))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+# Seconds a request waits for a free connection before giving up.
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+# Idle connections older than this are pinged before being handed out.
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', 30))
+# Arbitrary key so concurrent releases/workers don't migrate at the same time.
+MIGRATION_LOCK_ID = 514801
+
+# Each entry is (version, sql). Append only; never edit an applied migration.
+MIGRATIONS = [
+    (1, '''
+        CREATE TABLE IF NOT EXISTS check_ins (
+            id SERIAL PRIMARY KEY,
+            first_name TEXT NOT NULL,
+            middle_name TEXT,
+            last_name TEXT NOT NULL,
+            id_passport TEXT NOT NULL,
+            email TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            ethnicity TEXT,
+            gender TEXT,
+            course TEXT,
+            week_number INTEGER,
+            check_in_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    '''),
+    (2, '''
+        CREATE INDEX IF NOT EXISTS check_ins_time_idx
+            ON check_ins (check_in_time DESC, id DESC);
+        CREATE INDEX IF NOT EXISTS check_ins_course_week_time_idx
+            ON check_ins (course, week_number, check_in_time DESC, id DESC);
+        CREATE INDEX IF NOT EXISTS check_ins_id_passport_idx
+            ON check_ins (id_passport text_pattern_ops);
+        CREATE INDEX IF NOT EXISTS check_ins_first_name_idx
+            ON check_ins (lower(first_name) text_pattern_ops);
+        CREATE INDEX IF NOT EXISTS check_ins_last_name_idx
+            ON check_ins (lower(last_name) text_pattern_ops);
+    '''),
+    (3, '''
+        -- Keep the earliest row per student/course/week; later repeats are
+        -- archived in check_ins_duplicates rather than thrown away.
+        CREATE TABLE IF NOT EXISTS check_ins_duplicates (LIKE check_ins);
+        INSERT INTO check_ins_duplicates
+            SELECT a.* FROM check_ins a
+            WHERE EXISTS (
+                SELECT 1 FROM check_ins b
+                WHERE a.id_passport = b.id_passport AND a.course IS NOT DISTINCT FROM b.course
+                  AND a.week_number IS NOT DISTINCT FROM b.week_number AND a.id > b.id);
+        DELETE FROM check_ins WHERE id IN (SELECT id FROM check_ins_duplicates);
+        CREATE UNIQUE INDEX IF NOT EXISTS check_ins_student_week_key
+            ON check_ins (id_passport, course, week_number);
+    '''),
+    (4, '''
+        ALTER TABLE check_ins ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION;
+        ALTER TABLE check_ins ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION;
+        ALTER TABLE check_ins ADD COLUMN IF NOT EXISTS site TEXT;
+    '''),
+    (5, '''
+        CREATE TABLE IF NOT EXISTS attendance_weekly (
+            course TEXT NOT NULL,
+            week_number INTEGER NOT NULL,
+            gender TEXT NOT NULL,
+            ethnicity TEXT NOT NULL,
+            check_ins INTEGER NOT NULL DEFAULT 0,
+            new_students INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (course, week_number, gender, ethnicity)
+        );
+        CREATE OR REPLACE VIEW attendance_weekly_raw AS
+            SELECT COALESCE(course, '') AS course, week_number,
+                COALESCE(gender, '') AS gender, COALESCE(ethnicity, '') AS ethnicity,
+                COUNT(*)::INTEGER AS check_ins,
+                (COUNT(*) FILTER (WHERE week_number = first_week))::INTEGER AS new_students
+            FROM (
+                SELECT course, week_number, gender, ethnicity,
+                    MIN(week_number) OVER (PARTITION BY id_passport, course) AS first_week
+                FROM check_ins
+            ) c
+            GROUP BY 1, 2, 3, 4;
+        INSERT INTO attendance_weekly
+            (course, week_number, gender, ethnicity, check_ins, new_students)
+            SELECT course, week_number, gender, ethnicity, check_ins, new_students
+            FROM attendance_weekly_raw
+            ON CONFLICT DO NOTHING;
+    '''),
+    (6, '''
+        CREATE TABLE IF NOT EXISTS attendance_weekly_delta (
+            id BIGSERIAL PRIMARY KEY,
+            course TEXT NOT NULL,
+            week_number INTEGER NOT NULL,
+            gender TEXT NOT NULL,
+            ethnicity TEXT NOT NULL,
+            check_ins INTEGER NOT NULL,
+            new_students INTEGER NOT NULL
+        );
+    '''),
+]
+
+_pool = None
+_pool_pid = None
+# psycopg2 raises as soon as the pool is exhausted; this makes callers wait.
+_pool_slots = None
+_pool_lock = threading.Lock()
+_last_used = {}
+
+
+def get_db_url():
+    """Corrects the postgres prefix for SQLAlchemy/Psycopg2 compatibility."""
+    url = os.environ.get('DATABASE_URL')
+    if url and url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql://", 1)
+    return url
+
+
+def _statement_kind(query):
+    if isinstance(query, bytes):
+        query = query[:32].decode('ascii', 'replace')
+    elif not isinstance(query, str):
+        return 'composed'
+    words = query.split(None, 1)
+    return words[0].upper() if words else ''
+
+
+_timed_cursors = {}
+
+
+def _timed_cursor(base):
+    """Subclass of a cursor class whose execute() feeds QUERY_SECONDS."""
+    cls = _timed_cursors.get(base)
+    if cls is None:
+        class TimedCursor(base):
+            def execute(self, query, vars=None):
+                start = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    QUERY_SECONDS.labels(statement=_statement_kind(query)).observe(time.perf_counter() - start)
+
+        cls = _timed_cursors[base] = TimedCursor
+    return cls
+
+
+class TimedConnection(extensions.connection):
+    """Connection that times every cursor execute and commit."""
+
+    def cursor(self, *args, **kwargs):
+        kwargs['cursor_factory'] = _timed_cursor(kwargs.get('cursor_factory') or self.cursor_factory or extensions.cursor)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            COMMIT_SECONDS.observe(time.perf_counter() - start)
+
+
+def get_pool():
+    """Returns this process's pool, building a fresh one after a fork."""
+    global _pool, _pool_pid, _pool_slots
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                # Sockets inherited from a parent process are left alone;
+                # closing them here would terminate the parent's sessions.
+                _last_used.clear()
+                _pool = pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, get_db_url(),
+                                                    connection_factory=TimedConnection)
+                _pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+                _pool_pid = pid
+    return _pool
+
+
+def close_pool():
+    """Closes every pooled connection owned by this process."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid() and not _pool.closed:
+            _pool.closeall()
+        _pool = None
+        _last_used.clear()
+
+
+# ingest imports this module first, so its batch writer's exit hook is
+# registered later and (atexit being LIFO) drains before the pool closes.
+atexit.register(close_pool)
+
+
+def _is_healthy(conn):
+    if conn.closed or conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    last_used = _last_used.get(id(conn))
+    if last_used is None or time.monotonic() - last_used < DB_POOL_PING_AFTER:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _checkout(db_pool):
+    # Each discarded connection shrinks the idle list, so this ends with
+    # either a healthy idle connection or a freshly opened one.
+    while True:
+        conn = db_pool.getconn()
+        if _is_healthy(conn):
+            return conn
+        _last_used.pop(id(conn), None)
+        db_pool.putconn(conn, close=True)
+
+
+@contextmanager
+def get_db_connection():
+    """Borrows a pooled connection and always hands it back.
+
+    Uncommitted work is rolled back on the way out; a connection that
+    fails to roll back is discarded instead of being reused.
+    """
+    start = time.perf_counter()
+    db_pool = get_pool()
+    slots = _pool_slots
+    if not slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise pool.PoolError(f"no database connection free after {DB_POOL_TIMEOUT}s")
+    try:
+        conn = _checkout(db_pool)
+    except Exception:
+        slots.release()
+        raise
+    CONNECTION_ACQUIRE_SECONDS.observe(time.perf_counter() - start)
+    discard = False
+    try:
+        yield conn
+    finally:
+        if not conn.closed and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        discard = discard or conn.closed
+        if discard:
+            _last_used.pop(id(conn), None)
+        else:
+            _last_used[id(conn)] = time.monotonic()
+        try:
+            db_pool.putconn(conn, close=discard)
+        finally:
+            slots.release()
+
+
+def init_db():
+    """Creates the schema and applies any pending migrations."""
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT pg_advisory_xact_lock(%s)', (MIGRATION_LOCK_ID,))
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cur.execute('SELECT version FROM schema_migrations')
+        applied = {row[0] for row in cur.fetchall()}
+        pending = [(v, sql) for v, sql in MIGRATIONS if v not in applied]
+        for version, sql in pending:
+            cur.execute(sql)
+            cur.execute('INSERT INTO schema_migrations (version) VALUES (%s)', (version,))
+        conn.commit()
+        cur.close()
+    return [v for v, _ in pending]
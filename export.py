@@ -0,0 +1,133 @@
+import glob
+import os
+import tempfile
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.drawing.image import Image as OpenpyxlImage
+from openpyxl.styles import Font, PatternFill
+
+from db import get_db_connection
+
+# CONFIGURATION
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EXPORT_DIR = os.path.join(BASE_DIR, 'exports')
+LOGO_PATH = os.path.join(BASE_DIR, 'static', 'images', 'logo.jpg')
+EXPORT_FETCH_SIZE = 2000
+
+EXPORT_COLUMNS = [
+    ('id', 'ID'), ('first_name', 'First Name'), ('middle_name', 'Middle Name'),
+    ('last_name', 'Last Name'), ('id_passport', 'ID/Passport'), ('email', 'Email'),
+    ('phone', 'Phone'), ('ethnicity', 'Ethnicity'), ('gender', 'Gender'),
+    ('course', 'Course'), ('week_number', 'Week'), ('check_in_time', 'Time'),
+]
+NAVY = '003366'
+
+
+def export_filename(course, week_number):
+    """The name admins see when downloading a weekly sheet."""
+    return f"SouthernLabs_{course}_Week_{week_number}.xlsx"
+
+
+def _cache_path(course, week_number, row_count, max_id):
+    # The stamp changes whenever a check-in is added to (or removed from)
+    # this course/week, so a stale workbook is never served.
+    stem = export_filename(course, week_number)[:-len('.xlsx')]
+    return os.path.join(EXPORT_DIR, f"{stem}.{row_count}-{max_id}.xlsx")
+
+
+def _prune_stale(course, week_number, keep):
+    stem = export_filename(course, week_number)[:-len('.xlsx')]
+    for path in glob.glob(os.path.join(EXPORT_DIR, glob.escape(stem) + '.*-*.xlsx')):
+        if path != keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _styled(ws, value, **style):
+    cell = WriteOnlyCell(ws, value=value)
+    for name, attr in style.items():
+        setattr(cell, name, attr)
+    return cell
+
+
+def _write_workbook(rows, path, course, week_number):
+    """Streams rows into a write-only workbook so memory stays flat."""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Attendance')
+    for i in range(len(EXPORT_COLUMNS)):
+        ws.column_dimensions[chr(ord('A') + i)].width = 22
+
+    if os.path.exists(LOGO_PATH):
+        logo = OpenpyxlImage(LOGO_PATH)
+        logo.width, logo.height = 200, 80
+        ws.add_image(logo, 'A1')
+
+    ws.append([])
+    ws.append([None, None, None, _styled(ws, 'Southern Labs Institute of Technology',
+                                         font=Font(bold=True, size=16, color=NAVY))])
+    ws.append([None, None, None, _styled(ws, f'Attendance Report: {course} - Week {week_number}',
+                                         font=Font(bold=True, size=12))])
+    ws.append([])
+    ws.append([])
+
+    header_font = Font(bold=True, color='FFFFFF')
+    header_fill = PatternFill(start_color=NAVY, end_color=NAVY, fill_type='solid')
+    ws.append([_styled(ws, label, font=header_font, fill=header_fill) for _, label in EXPORT_COLUMNS])
+
+    for row in rows:
+        row = list(row)
+        if row[-1] is not None:
+            row[-1] = row[-1].strftime('%Y-%m-%d %H:%M:%S')
+        ws.append(row)
+    wb.save(path)
+
+
+def get_week_export(course, week_number):
+    """Returns an open binary file of an up-to-date workbook for one course and week.
+
+    A cached copy in exports/ is reused until new check-ins arrive for
+    that course and week; otherwise the sheet is rebuilt from a
+    server-side cursor. The file is opened before returning so a
+    concurrent rebuild pruning it can't pull it out from under the caller.
+
+    A rebuild keeps its pooled connection for the whole build, because
+    the server-side cursor streams from it. Size DB_POOL_MAX with room
+    for exports running alongside check-ins.
+    """
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        # One snapshot for both the cache stamp and the rows it describes.
+        cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        cur.execute('''SELECT COUNT(*), COALESCE(MAX(id), 0) FROM check_ins
+            WHERE course = %s AND week_number = %s''', (course, week_number))
+        row_count, max_id = cur.fetchone()
+        cur.close()
+
+        path = _cache_path(course, week_number, row_count, max_id)
+        try:
+            return open(path, 'rb')
+        except FileNotFoundError:
+            pass
+
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        rows = conn.cursor(name='week_export')
+        rows.itersize = EXPORT_FETCH_SIZE
+        rows.execute(f'''SELECT {", ".join(col for col, _ in EXPORT_COLUMNS)} FROM check_ins
+            WHERE course = %s AND week_number = %s
+            ORDER BY check_in_time, id''', (course, week_number))
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', suffix='.xlsx', dir=EXPORT_DIR)
+        os.close(fd)
+        try:
+            _write_workbook(rows, tmp_path, course, week_number)
+            os.replace(tmp_path, path)
+        finally:
+            rows.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    export = open(path, 'rb')
+    _prune_stale(course, week_number, keep=path)
+    return export
@@ -0,0 +1,152 @@
+import json
+import os
+from math import asin, cos, floor, pi, radians, sin, sqrt
+
+import numpy as np
+
+# CONFIGURATION
+EARTH_RADIUS_KM = 6371
+# Grid cell size in degrees (~1.1 km of latitude); sites are bucketed into
+# every cell their bounding box touches so a lookup only tests nearby sites.
+GRID_CELL_DEG = 0.01
+# JSON list of {"name", "lat", "lon", "radius_km", "courses"}; a missing or
+# empty "courses" list means the site accepts every course.
+GEOFENCE_SITES_FILE = os.environ.get('GEOFENCE_SITES_FILE')
+DEFAULT_SITES = [
+    {'name': '85 Grayston Drive', 'lat': -26.099059, 'lon': 28.0538272, 'radius_km': 0.2, 'courses': []},
+]
+
+
+class Site:
+    """A check-in venue with its trig terms precomputed once at load time."""
+
+    __slots__ = ('name', 'lat', 'lon', 'radius_km', 'courses',
+                 'lat_rad', 'lon_rad', 'cos_lat', 'min_lat', 'max_lat', 'min_lon', 'max_lon')
+
+    def __init__(self, name, lat, lon, radius_km, courses=None):
+        self.name = name
+        self.lat = float(lat)
+        self.lon = float(lon)
+        self.radius_km = float(radius_km)
+        self.courses = frozenset(courses or ())
+        self.lat_rad = radians(self.lat)
+        self.lon_rad = radians(self.lon)
+        self.cos_lat = cos(self.lat_rad)
+        # Bounding box that fully contains the radius, for cheap rejection.
+        dlat = self.radius_km / EARTH_RADIUS_KM * 180 / pi
+        dlon = dlat / max(self.cos_lat, 1e-6)
+        self.min_lat, self.max_lat = self.lat - dlat, self.lat + dlat
+        self.min_lon, self.max_lon = self.lon - dlon, self.lon + dlon
+
+    def allows(self, course):
+        return not self.courses or course in self.courses
+
+    def distance_km(self, lat, lon):
+        """Haversine distance using this site's precomputed terms."""
+        lat_rad, lon_rad = radians(lat), radians(lon)
+        a = sin((lat_rad - self.lat_rad) / 2) ** 2 + cos(lat_rad) * self.cos_lat * sin((lon_rad - self.lon_rad) / 2) ** 2
+        return 2 * asin(sqrt(a)) * EARTH_RADIUS_KM
+
+
+def _cell(lat, lon):
+    return (floor(lat / GRID_CELL_DEG), floor(lon / GRID_CELL_DEG))
+
+
+class Geofence:
+    """Matches coordinates against a set of sites."""
+
+    def __init__(self, sites):
+        self.sites = list(sites)
+        self._grid = {}
+        for site in self.sites:
+            lat0, lon0 = _cell(site.min_lat, site.min_lon)
+            lat1, lon1 = _cell(site.max_lat, site.max_lon)
+            for i in range(lat0, lat1 + 1):
+                for j in range(lon0, lon1 + 1):
+                    self._grid.setdefault((i, j), []).append(site)
+        self._lat_rad = np.array([s.lat_rad for s in self.sites])
+        self._lon_rad = np.array([s.lon_rad for s in self.sites])
+        self._cos_lat = np.array([s.cos_lat for s in self.sites])
+        self._radius_km = np.array([s.radius_km for s in self.sites])
+
+    def match(self, lat, lon, course=None):
+        """Returns the closest site within range that allows course, or None."""
+        best, best_dist = None, None
+        for site in self._grid.get(_cell(lat, lon), ()):
+            if not (site.min_lat <= lat <= site.max_lat and site.min_lon <= lon <= site.max_lon):
+                continue
+            if not site.allows(course):
+                continue
+            dist = site.distance_km(lat, lon)
+            if dist <= site.radius_km and (best_dist is None or dist < best_dist):
+                best, best_dist = site, dist
+        return best
+
+    def nearest(self, lat, lon, course=None):
+        """Returns (site, distance_km) for the closest site allowing course.
+
+        Scans every site, so it is meant for the rejection message only.
+        """
+        candidates = [s for s in self.sites if s.allows(course)] or self.sites
+        dists = [s.distance_km(lat, lon) for s in candidates]
+        i = int(np.argmin(dists))
+        return candidates[i], dists[i]
+
+    def distances_km(self, lats, lons):
+        """(points x sites) haversine distances for arrays of coordinates."""
+        lat_rad = np.radians(np.asarray(lats, dtype=float))[:, None]
+        lon_rad = np.radians(np.asarray(lons, dtype=float))[:, None]
+        a = (np.sin((lat_rad - self._lat_rad) / 2) ** 2
+             + np.cos(lat_rad) * self._cos_lat * np.sin((lon_rad - self._lon_rad) / 2) ** 2)
+        return 2 * np.arcsin(np.sqrt(a)) * EARTH_RADIUS_KM
+
+    def match_many(self, lats, lons, courses=None):
+        """Vectorized match(); returns an array of site indexes, -1 for none."""
+        dists = self.distances_km(lats, lons)
+        inside = dists <= self._radius_km
+        if courses is not None:
+            courses = np.asarray(courses, dtype=object)
+            for k, site in enumerate(self.sites):
+                if site.courses:
+                    inside[:, k] &= np.isin(courses, list(site.courses))
+        dists = np.where(inside, dists, np.inf)
+        best = np.argmin(dists, axis=1) if self.sites else np.zeros(len(dists), dtype=int)
+        return np.where(inside.any(axis=1), best, -1)
+
+
+def load_sites(path=GEOFENCE_SITES_FILE):
+    """Reads site definitions from a JSON file, or the built-in campus.
+
+    Raises ValueError naming the file and entry if the list is empty or
+    a site is missing or has an invalid name, lat, lon or radius_km.
+    """
+    entries = DEFAULT_SITES
+    source = 'DEFAULT_SITES'
+    if path:
+        source = path
+        with open(path) as f:
+            entries = json.load(f)
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{source}: expected a non-empty JSON list of geofence sites")
+
+    sites = []
+    for i, e in enumerate(entries):
+        if not isinstance(e, dict):
+            raise ValueError(f"{source}: site #{i} must be an object")
+        missing = [k for k in ('name', 'lat', 'lon', 'radius_km') if e.get(k) in (None, '')]
+        if missing:
+            raise ValueError(f"{source}: site #{i} is missing {', '.join(missing)}")
+        courses = e.get('courses')
+        if courses is not None and not isinstance(courses, list):
+            raise ValueError(f"{source}: site {e['name']!r} courses must be a list")
+        try:
+            site = Site(e['name'], e['lat'], e['lon'], e['radius_km'], courses)
+        except (TypeError, ValueError):
+            raise ValueError(f"{source}: site {e['name']!r} needs numeric lat, lon and radius_km")
+        if not (-90 <= site.lat <= 90 and -180 <= site.lon <= 180) or site.radius_km <= 0:
+            raise ValueError(f"{source}: site {e['name']!r} has out-of-range coordinates or radius")
+        sites.append(site)
+    return sites
+
+
+geofence = Geofence(load_sites())
@@ -0,0 +1,19 @@
+import os
+import shutil
+import tempfile
+
+# Workers write their metrics here so /metrics can report all of them.
+# Must be set before the app (and prometheus_client) is imported.
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                                    os.path.join(tempfile.gettempdir(), 'slabs-checkin-metrics'))
+
+
+def on_starting(server):
+    # Files left by a previous server would be summed into this one's totals.
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
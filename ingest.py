@@ -0,0 +1,251 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from psycopg2.extras import execute_values
+
+from db import get_db_connection
+from stats import record_check_ins
+
+# CONFIGURATION
+# 'direct' commits each check-in on the request thread; 'batched' hands it
+# to a background writer that group-commits bursts in multi-row INSERTs.
+INGEST_MODE = os.environ.get('INGEST_MODE', 'direct')
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 100))
+INGEST_FLUSH_INTERVAL = float(os.environ.get('INGEST_FLUSH_INTERVAL', 0.05))
+INGEST_WAIT_TIMEOUT = float(os.environ.get('INGEST_WAIT_TIMEOUT', 10))
+CHECKED_IN_CACHE_SIZE = int(os.environ.get('CHECKED_IN_CACHE_SIZE', 5000))
+
+CHECK_IN_COLUMNS = ('first_name', 'middle_name', 'last_name', 'id_passport', 'email',
+                    'phone', 'ethnicity', 'gender', 'course', 'week_number',
+                    'latitude', 'longitude', 'site', 'check_in_time')
+
+
+def check_in_key(row):
+    """(id_passport, course, week_number): one check-in per student per week."""
+    return (row[3], row[8], row[9])
+
+
+def insert_check_ins(cur, rows):
+    """Writes check-in tuples (in CHECK_IN_COLUMNS order) with one statement.
+
+    Rows that repeat an existing (id_passport, course, week_number) are
+    skipped; returns the set of keys that were actually inserted. The
+    weekly attendance summary is updated in the same transaction.
+    """
+    # Concurrent batches take unique-index locks in key order, so they can't
+    # deadlock; the sort is stable, so the first of any in-batch repeats wins.
+    rows = sorted(rows, key=check_in_key)
+    inserted = execute_values(cur, f'''INSERT INTO check_ins ({", ".join(CHECK_IN_COLUMNS)})
+        VALUES %s
+        ON CONFLICT (id_passport, course, week_number) DO NOTHING
+        RETURNING id, id_passport, course, week_number''', rows, page_size=max(len(rows), 1), fetch=True)
+    record_check_ins(cur, [row[0] for row in inserted])
+    return {tuple(row[1:]) for row in inserted}
+
+
+class CheckedInCache:
+    """Bounded LRU of students already checked in, keyed by check_in_key().
+
+    Only confirmed check-ins are remembered, so a hit can be rejected
+    without a database round trip. Seeing a later week_number means the
+    week (counted from START_DATE) has rolled over, and entries for
+    earlier weeks are dropped.
+    """
+
+    def __init__(self, maxsize=CHECKED_IN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.week = None
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _roll(self, week):
+        if week is not None and (self.week is None or week > self.week):
+            self.week = week
+            self._keys = OrderedDict((k, None) for k in self._keys if k[2] >= week)
+
+    def __contains__(self, key):
+        with self._lock:
+            self._roll(key[2])
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                return True
+            return False
+
+    def add(self, key):
+        with self._lock:
+            self._roll(key[2])
+            self._keys[key] = None
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+
+
+class _Pending:
+    __slots__ = ('row', 'done', 'error', 'inserted')
+
+    def __init__(self, row):
+        self.row = row
+        self.done = threading.Event()
+        self.error = None
+        self.inserted = False
+
+
+class BatchWriter:
+    """Background thread that group-commits queued check-ins.
+
+    A batch is flushed once it holds batch_size rows or the oldest row has
+    waited flush_interval seconds. Callers block until their own row is
+    committed (or has failed), so a confirmation still means "written".
+    """
+
+    _STOP = object()
+
+    def __init__(self, batch_size=INGEST_BATCH_SIZE, flush_interval=INGEST_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        # Started lazily so each gunicorn worker gets its own writer thread.
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, name='check-in-writer', daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def submit(self, row, timeout=INGEST_WAIT_TIMEOUT):
+        """Queues one check-in and waits until it has been committed.
+
+        Returns False if the student had already checked in this week.
+        """
+        self._ensure_started()
+        pending = _Pending(row)
+        self._queue.put(pending)
+        if not pending.done.wait(timeout):
+            raise TimeoutError("Check-in was not written in time")
+        if pending.error is not None:
+            raise pending.error
+        return pending.inserted
+
+    def close(self, timeout=None):
+        """Stops the writer after draining everything already queued."""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid() or not thread.is_alive():
+            return
+        self._queue.put(self._STOP)
+        thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is self._STOP:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+        # Anything that raced in behind the stop marker is still written.
+        leftovers = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not self._STOP:
+                leftovers.append(item)
+        for start in range(0, len(leftovers), self.batch_size):
+            self._flush(leftovers[start:start + self.batch_size])
+
+    def _flush(self, batch):
+        try:
+            with get_db_connection() as conn:
+                cur = conn.cursor()
+                inserted = insert_check_ins(cur, [p.row for p in batch])
+                conn.commit()
+                cur.close()
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0].error = e
+            else:
+                # The batch rolled back as a unit; retry row by row so one
+                # bad check-in doesn't fail everyone it was grouped with.
+                for pending in batch:
+                    self._flush([pending])
+                return
+        else:
+            # Within one batch the first row for a key is the one written.
+            for pending in batch:
+                key = check_in_key(pending.row)
+                pending.inserted = key in inserted
+                inserted.discard(key)
+        for pending in batch:
+            pending.done.set()
+
+
+_writer = BatchWriter()
+atexit.register(_writer.close)
+_checked_in = CheckedInCache()
+
+
+def write_check_in(row):
+    """Persists one check-in using the configured INGEST_MODE.
+
+    Returns False, without writing, if the student has already checked
+    in for this course and week.
+    """
+    key = check_in_key(row)
+    if key in _checked_in:
+        return False
+    if INGEST_MODE == 'batched':
+        inserted = _writer.submit(row)
+    else:
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            inserted = bool(insert_check_ins(cur, [row]))
+            conn.commit()
+            cur.close()
+    _checked_in.add(key)
+    return inserted
+
+
+def write_check_ins(rows):
+    """Persists many check-ins in one transaction, bypassing the batch writer.
+
+    Returns one flag per row: True if written, False if that student was
+    already checked in for the course and week (including earlier in rows).
+    """
+    fresh = [row for row in rows if check_in_key(row) not in _checked_in]
+    inserted = set()
+    if fresh:
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            inserted = insert_check_ins(cur, fresh)
+            conn.commit()
+            cur.close()
+    results = []
+    for row in rows:
+        key = check_in_key(row)
+        results.append(key in inserted)
+        inserted.discard(key)
+        _checked_in.add(key)
+    return results
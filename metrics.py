@@ -0,0 +1,38 @@
+import os
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+
+# Under gunicorn every worker records into its own files in
+# PROMETHEUS_MULTIPROC_DIR (set up by gunicorn.conf.py) and /metrics sums
+# them, so any worker can answer a scrape for the whole server. Without
+# it, metrics cover this process only (flask run, the in-process benchmark).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DISTANCE_BUCKETS = (50, 100, 200, 500, 1000, 5000, 10000, 100000)
+
+
+def render_metrics():
+    """Returns (body, content type) for every metric in the Prometheus text format."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', "Request latency by route.", ('method', 'route', 'status'),
+    buckets=LATENCY_BUCKETS)
+QUERY_SECONDS = Histogram(
+    'db_query_duration_seconds', "Cursor execute latency by statement type.", ('statement',),
+    buckets=LATENCY_BUCKETS)
+COMMIT_SECONDS = Histogram(
+    'db_commit_duration_seconds', "Transaction commit latency.", buckets=LATENCY_BUCKETS)
+CONNECTION_ACQUIRE_SECONDS = Histogram(
+    'db_connection_acquire_seconds', "Time to borrow a healthy pooled connection.", buckets=LATENCY_BUCKETS)
+GEOFENCE_REJECTIONS = Counter(
+    'checkin_geofence_rejections_total', "Check-ins outside every allowed site.", ('site',))
+GEOFENCE_REJECTED_DISTANCE = Histogram(
+    'checkin_geofence_rejected_distance_meters', "Distance to the nearest allowed site for rejected check-ins.",
+    ('site',), buckets=DISTANCE_BUCKETS)
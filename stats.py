@@ -0,0 +1,147 @@
+from psycopg2.extras import RealDictCursor
+
+# Appends the deltas for a set of freshly inserted check_ins ids to
+# attendance_weekly_delta. The delta table is insert-only, so check-in
+# transactions never wait on each other for a shared counter row; deltas
+# are folded into attendance_weekly later by fold_weekly_deltas(). A
+# student is "new" in their earliest week for a course; when a backfilled
+# row lands before a week that was previously their first, that later
+# week is moved from new to returning.
+_RECORD_SQL = '''
+    WITH batch AS (
+        SELECT * FROM check_ins WHERE id = ANY(%(ids)s)
+    ), deltas AS (
+        SELECT b.course, b.week_number, b.gender, b.ethnicity, 1 AS check_ins,
+            CASE WHEN EXISTS (
+                SELECT 1 FROM check_ins o
+                WHERE o.id_passport = b.id_passport AND o.course IS NOT DISTINCT FROM b.course
+                  AND o.week_number < b.week_number
+            ) THEN 0 ELSE 1 END AS new_students
+        FROM batch b
+        UNION ALL
+        SELECT x.course, x.week_number, x.gender, x.ethnicity, 0, -1
+        FROM check_ins x
+        WHERE x.id <> ALL(%(ids)s)
+          AND EXISTS (
+            SELECT 1 FROM batch b
+            WHERE b.id_passport = x.id_passport AND b.course IS NOT DISTINCT FROM x.course
+              AND b.week_number < x.week_number)
+          AND NOT EXISTS (
+            SELECT 1 FROM check_ins o
+            WHERE o.id <> ALL(%(ids)s) AND o.id_passport = x.id_passport
+              AND o.course IS NOT DISTINCT FROM x.course AND o.week_number < x.week_number)
+    )
+    INSERT INTO attendance_weekly_delta (course, week_number, gender, ethnicity, check_ins, new_students)
+    SELECT COALESCE(course, ''), week_number, COALESCE(gender, ''), COALESCE(ethnicity, ''),
+        SUM(check_ins), SUM(new_students)
+    FROM deltas
+    GROUP BY 1, 2, 3, 4
+'''
+
+# attendance_weekly plus any deltas not yet folded into it.
+_TOTALS_SQL = '''
+    SELECT course, week_number, gender, ethnicity,
+        SUM(check_ins)::INTEGER AS check_ins, SUM(new_students)::INTEGER AS new_students
+    FROM (
+        SELECT course, week_number, gender, ethnicity, check_ins, new_students FROM attendance_weekly
+        UNION ALL
+        SELECT course, week_number, gender, ethnicity, check_ins, new_students FROM attendance_weekly_delta
+    ) t
+    GROUP BY 1, 2, 3, 4
+'''
+
+_FOLD_SQL = '''
+    WITH moved AS (
+        DELETE FROM attendance_weekly_delta
+        RETURNING course, week_number, gender, ethnicity, check_ins, new_students
+    )
+    INSERT INTO attendance_weekly AS w (course, week_number, gender, ethnicity, check_ins, new_students)
+    SELECT course, week_number, gender, ethnicity, SUM(check_ins), SUM(new_students)
+    FROM moved
+    GROUP BY 1, 2, 3, 4
+    -- Take row locks in key order so concurrent folds can't deadlock.
+    ORDER BY 1, 2, 3, 4
+    ON CONFLICT (course, week_number, gender, ethnicity) DO UPDATE SET
+        check_ins = w.check_ins + EXCLUDED.check_ins,
+        new_students = w.new_students + EXCLUDED.new_students
+'''
+
+_DRIFT_SQL = f'''
+    SELECT COUNT(*) FROM ({_TOTALS_SQL}) w
+    FULL OUTER JOIN attendance_weekly_raw r
+        USING (course, week_number, gender, ethnicity)
+    WHERE w.check_ins IS DISTINCT FROM r.check_ins
+       OR w.new_students IS DISTINCT FROM r.new_students
+'''
+
+
+def record_check_ins(cur, ids):
+    """Records newly inserted check-ins as attendance_weekly_delta rows.
+
+    Must run in the same transaction as the INSERT so the summary never
+    drifts from check_ins.
+    """
+    if ids:
+        cur.execute(_RECORD_SQL, {'ids': list(ids)})
+
+
+def fold_weekly_deltas(conn):
+    """Moves pending deltas into attendance_weekly; returns groups updated.
+
+    Run it periodically (e.g. a scheduler calling 'flask fold-stats') so
+    reads only sum a short tail of deltas.
+    """
+    cur = conn.cursor()
+    cur.execute(_FOLD_SQL)
+    updated = cur.rowcount
+    conn.commit()
+    cur.close()
+    return updated
+
+
+def rebuild_weekly_stats(conn):
+    """Recomputes attendance_weekly from check_ins and clears pending deltas.
+
+    Returns how many (course, week, gender, ethnicity) groups disagreed
+    with the raw data before the rebuild.
+    """
+    cur = conn.cursor()
+    # Hold off writers so nothing lands between the check and the rebuild.
+    cur.execute('LOCK TABLE check_ins IN SHARE MODE')
+    cur.execute(_DRIFT_SQL)
+    drift = cur.fetchone()[0]
+    cur.execute('DELETE FROM attendance_weekly')
+    cur.execute('DELETE FROM attendance_weekly_delta')
+    cur.execute('''INSERT INTO attendance_weekly
+        (course, week_number, gender, ethnicity, check_ins, new_students)
+        SELECT course, week_number, gender, ethnicity, check_ins, new_students
+        FROM attendance_weekly_raw''')
+    conn.commit()
+    cur.close()
+    return drift
+
+
+def fetch_weekly_stats(conn, course=None):
+    """Summarises attendance_weekly per course and week for the dashboard."""
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(f'''SELECT * FROM ({_TOTALS_SQL}) t
+        WHERE %(course)s IS NULL OR course = %(course)s
+        ORDER BY course, week_number''', {'course': course})
+    rows = cur.fetchall()
+    cur.close()
+
+    weeks = {}
+    for row in rows:
+        week = weeks.setdefault((row['course'], row['week_number']), {
+            'course': row['course'], 'week_number': row['week_number'],
+            'check_ins': 0, 'new_students': 0, 'returning_students': 0,
+            'gender': {}, 'ethnicity': {},
+        })
+        week['check_ins'] += row['check_ins']
+        week['new_students'] += row['new_students']
+        week['returning_students'] += row['check_ins'] - row['new_students']
+        gender = row['gender'] or 'Unspecified'
+        ethnicity = row['ethnicity'] or 'Unspecified'
+        week['gender'][gender] = week['gender'].get(gender, 0) + row['check_ins']
+        week['ethnicity'][ethnicity] = week['ethnicity'].get(ethnicity, 0) + row['check_ins']
+    return list(weeks.values())
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as app_module
+
+TOKEN = 'kiosk-secret'
+
+
+@pytest.fixture
+def client(monkeypatch):
+    written = set()
+
+    def write_check_ins(rows):
+        results = []
+        for row in rows:
+            key = (row[3], row[8], row[9])
+            results.append(key not in written)
+            written.add(key)
+        return results
+
+    monkeypatch.setattr(app_module, 'write_check_ins', write_check_ins)
+    monkeypatch.setattr(app_module, 'KIOSK_API_TOKEN', TOKEN)
+    return app_module.app.test_client()
+
+
+def make_item(n, **overrides):
+    item = {
+        'first_name': 'First', 'last_name': 'Last', 'id_passport': f'ID{n}',
+        'email': 'e@example.com', 'phone': '0710000000', 'ethnicity': 'Black African',
+        'gender': 'Female', 'course': 'WPE', 'latitude': -26.099059, 'longitude': 28.0538272,
+        'timestamp': datetime.now().isoformat(),
+    }
+    item.update(overrides)
+    return item
+
+
+def post(client, items, token=TOKEN):
+    headers = {'Authorization': f'Bearer {token}'} if token else {}
+    return client.post('/api/checkins', json=items, headers=headers)
+
+
+def test_reports_a_status_per_item(client):
+    items = [
+        make_item(1),
+        make_item(1),
+        make_item(2, first_name={'$gt': ''}),
+        make_item(3, latitude='nan', longitude='nan'),
+        make_item(4, timestamp='2099-01-01T09:00:00'),
+        make_item(5, course='ANY'),
+        make_item(6, timestamp=(datetime.now() - app_module.API_MAX_BACKFILL - timedelta(days=1)).isoformat()),
+        'not an object',
+    ]
+    response = post(client, items)
+
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [r['index'] for r in results] == list(range(len(items)))
+    assert [r['status'] for r in results] == [
+        'created', 'duplicate', 'rejected', 'rejected', 'rejected', 'rejected', 'rejected', 'rejected']
+    assert results[0]['week_number'] == app_module.week_number_for(datetime.now())
+    assert 'first_name' in results[2]['error']
+    assert 'future' in results[4]['error']
+    assert 'WPE' in results[5]['error']
+
+
+def test_requires_the_kiosk_token(client):
+    assert post(client, [make_item(1)], token=None).status_code == 401
+    assert post(client, [make_item(1)], token='wrong').status_code == 401
+
+
+def test_disabled_without_a_configured_token(client, monkeypatch):
+    monkeypatch.setattr(app_module, 'KIOSK_API_TOKEN', None)
+    assert post(client, [make_item(1)]).status_code == 403
+
+
+def test_rejects_a_non_list_payload(client):
+    assert post(client, {'check_ins': 'nope'}).status_code == 400
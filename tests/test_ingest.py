@@ -0,0 +1,174 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+
+import ingest
+
+
+class FakeDatabase:
+    """Stands in for get_db_connection/insert_check_ins with ON CONFLICT semantics."""
+
+    def __init__(self, fail=lambda row: False, gate=None):
+        self.fail = fail
+        self.gate = gate
+        self.rows = []
+        self.batches = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        yield FakeConnection(self)
+
+    def insert(self, cur, rows):
+        if self.gate is not None:
+            self.gate.wait()
+        if any(self.fail(row) for row in rows):
+            raise ValueError("bad row")
+        with self._lock:
+            known = {ingest.check_in_key(row) for row in self.rows}
+        inserted = set()
+        for row in rows:
+            key = ingest.check_in_key(row)
+            if key not in known and key not in inserted:
+                inserted.add(key)
+                cur.pending.append(row)
+        self.batches.append(len(rows))
+        return inserted
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+        self.pending = []
+
+    def cursor(self):
+        return self
+
+    def commit(self):
+        with self.db._lock:
+            self.db.rows.extend(self.pending)
+        self.pending = []
+
+    def close(self):
+        pass
+
+
+def make_row(n, id_passport=None):
+    return ('First', None, 'Last', id_passport or f'ID{n}', 'e@example.com', '0710000000',
+            'Black African', 'Female', 'WPE', 3, -26.099059, 28.0538272, '85 Grayston Drive', None)
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    def install(**kwargs):
+        db = FakeDatabase(**kwargs)
+        monkeypatch.setattr(ingest, 'get_db_connection', db.connection)
+        monkeypatch.setattr(ingest, 'insert_check_ins', db.insert)
+        return db
+    return install
+
+
+def submit_all(writer, rows):
+    results, errors = {}, {}
+
+    def submit(i, row):
+        try:
+            results[i] = writer.submit(row)
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=submit, args=(i, row)) for i, row in enumerate(rows)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_submits_write_each_row_exactly_once(fake_db):
+    db = fake_db()
+    writer = ingest.BatchWriter(batch_size=16, flush_interval=0.01)
+    rows = [make_row(n) for n in range(500)]
+
+    results, errors = submit_all(writer, rows)
+    writer.close()
+
+    assert not errors
+    assert all(results[i] for i in range(len(rows)))
+    assert sorted(row[3] for row in db.rows) == sorted(row[3] for row in rows)
+    assert max(db.batches) > 1
+
+
+def test_duplicate_keys_in_one_batch_insert_once(fake_db):
+    db = fake_db()
+    writer = ingest.BatchWriter(batch_size=50, flush_interval=0.2)
+
+    results, errors = submit_all(writer, [make_row(n, id_passport='SAME') for n in range(5)])
+    writer.close()
+
+    assert not errors
+    assert sorted(results.values()) == [False, False, False, False, True]
+    assert [row[3] for row in db.rows] == ['SAME']
+
+
+def test_failing_row_fails_alone(fake_db):
+    db = fake_db(fail=lambda row: row[3] == 'ID7')
+    writer = ingest.BatchWriter(batch_size=50, flush_interval=0.2)
+    rows = [make_row(n) for n in range(20)]
+
+    results, errors = submit_all(writer, rows)
+    writer.close()
+
+    assert list(errors) == [7]
+    assert isinstance(errors[7], ValueError)
+    assert all(results[i] for i in range(20) if i != 7)
+    assert sorted(row[3] for row in db.rows) == sorted(f'ID{n}' for n in range(20) if n != 7)
+
+
+def test_close_drains_queued_rows(fake_db):
+    gate = threading.Event()
+    db = fake_db(gate=gate)
+    writer = ingest.BatchWriter(batch_size=4, flush_interval=0.01)
+    rows = [make_row(n) for n in range(30)]
+
+    submitter = threading.Thread(target=submit_all, args=(writer, rows))
+    submitter.start()
+    # The first flush is held at the gate while the rest pile up in the queue.
+    deadline = time.monotonic() + 5
+    while writer._queue.qsize() < len(rows) - 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    closer = threading.Thread(target=writer.close)
+    closer.start()
+    gate.set()
+    closer.join(5)
+    submitter.join(5)
+
+    assert not closer.is_alive()
+    assert sorted(row[3] for row in db.rows) == sorted(row[3] for row in rows)
+
+
+def test_checked_in_cache_drops_earlier_weeks_on_rollover():
+    cache = ingest.CheckedInCache(maxsize=10)
+    cache.add(('ID1', 'WPE', 3))
+    cache.add(('ID2', 'MCC', 3))
+    assert ('ID1', 'WPE', 3) in cache
+
+    cache.add(('ID3', 'WPE', 4))
+    assert ('ID1', 'WPE', 3) not in cache
+    assert ('ID2', 'MCC', 3) not in cache
+    assert ('ID3', 'WPE', 4) in cache
+    # A late row for an older week never rolls the cache backwards.
+    assert ('ID9', 'WPE', 2) not in cache
+    assert cache.week == 4
+
+
+def test_checked_in_cache_evicts_least_recently_used():
+    cache = ingest.CheckedInCache(maxsize=2)
+    cache.add(('ID1', 'WPE', 3))
+    cache.add(('ID2', 'WPE', 3))
+    assert ('ID1', 'WPE', 3) in cache
+    cache.add(('ID3', 'WPE', 3))
+    assert ('ID2', 'WPE', 3) not in cache
+    assert ('ID1', 'WPE', 3) in cache